@@ -1,41 +1,94 @@
-import collections
+import hashlib
+import io
+import itertools
+import pickle
 import re
-from urllib.request import urlretrieve
-import pandas as pd
+import xlsxwriter
 import yaml
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
 from arxiv import SortCriterion, SortOrder, Search, Result, Client
 from typing import Dict, Generator, List, OrderedDict
 import json, os, time
 import logging
 import argparse
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit
+from lxml import etree
 from tqdm import tqdm
+from AT_download import Manifest, RateLimiter, build_session, download, fetch, run_bounded
 
 logger = logging.getLogger(__name__)
 
+_SANITIZE_RE = re.compile(r"[^\w]")
+# same as _SANITIZE_RE for ASCII text: every char but [A-Za-z0-9_] -> "_"
+_SANITIZE_TABLE = {c: "_" for c in range(128) if not (chr(c).isalnum() or chr(c) == "_")}
+_VERSION_RE = re.compile(r"v\d+$")
+
+# info config
+_DEFAULT_LIST = ['paper_id',             #   paper_id # 文章id
+                 'paper_title',          #   paper_title # 文章标题
+                 'paper_first_author',   #   paper_first_author # 文章的第一作者
+                 'paper_all_author',     #   paper_all_author  # 文章的所有作者
+                 'publish_time',         #   publish_time # 文章的发布时间
+                 'update_time',          #   update_time # 文章的更新时间
+                 'paper_summary',        #   paper_summary # 文章摘要
+                 'paper_url',            #   paper_url # 文章url
+                 'pdf_url',              #   pdf_url # 文章url
+                 'comment',              #   comment # 解释
+                 'doi',
+                 'primary_category',     # 文章主方向
+                 'categories']           # 文章涉及方向
+_DEFAULT_FIELDS = frozenset(_DEFAULT_LIST)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "daily_paper")
+
+# parsed yaml is cached as pickle, keyed by (path, mtime) so edits invalidate it
+def load_yaml(path):
+    path = os.path.abspath(path)
+    key = hashlib.sha1("{}:{}".format(path, os.path.getmtime(path)).encode()).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, key + ".pkl")
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        pass
+
+    # 将 YAML 字符串写入文件
+    with open(path, 'r', encoding='utf-8') as f:
+        info = yaml.load(f, Loader=_Loader)
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(info, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("Failed to cache config {}: {}".format(path, e))
+    return info
+
+# markdown table cell: one line, no bare "|"
+def md_cell(value):
+    if value is None:
+        return ""
+    return str(value).replace("\n", " ").replace("|", "\\|")
+
+# https, without query string or fragment
+def canonical_url(url):
+    if not url:
+        return url
+    parts = urlsplit(url)
+    return urlunsplit(("https", parts.netloc, parts.path, "", ""))
+
 # t: str '%Y-%m-%d' example "2023-9-30"
 def strp_time(t:str):
     if isinstance(t, str):
         return time.strptime(t, '%Y-%m-%d')
     return t
 
-# compare time if t_start <= t <= t_end
-def compare_time(t, t_start = None, t_end=None, strp=False):
-    if strp:
-        t = strp_time(t)
-        t_start = strp_time(t_start)
-        t_end = strp_time(t_end)
-    # check type(t_start), type(t_end) -->  time.struct_time
-    if t_start: assert isinstance(t_start, time.struct_time)
-    if t_end: assert isinstance(t_end, time.struct_time)
-    if t_start is None and t_end is None:
-        return True
-    elif t_start is None:
-        return t <= t_end
-    elif t_end is None:
-        return t >= t_start
-    else:
-        return t <= t_end and t >= t_start
-
 class ArxivSearch(Search):
     def results(self, offset: int = 0, s_time=None, e_time=None, strp=False) -> Generator[Result, None, None]:
         """
@@ -49,6 +102,16 @@ class ArxivClient(Client):
     def results(self, search: Search, offset: int = 0, s_time=None, e_time=None, strp=False) -> Generator[Result, None, None]:
         total_results = search.max_results
         first_page = True
+        # parse the bounds once, not per entry
+        if strp:
+            s_time = strp_time(s_time)
+            e_time = strp_time(e_time)
+        # check type(s_time), type(e_time) -->  time.struct_time
+        if s_time: assert isinstance(s_time, time.struct_time)
+        if e_time: assert isinstance(e_time, time.struct_time)
+        # newest first: the first entry older than s_time ends the whole search
+        newest_first = (search.sort_by == SortCriterion.SubmittedDate
+                        and search.sort_order == SortOrder.Descending)
 
         while offset < total_results:
             page_size = min(self.page_size, search.max_results - offset)
@@ -82,27 +145,123 @@ class ArxivClient(Client):
             # Yield query results until page is exhausted.
             for entry in feed.entries:
                 # filter with time:
-                if s_time or e_time:
-                    if not compare_time(entry.published_parsed, t_end=e_time, strp=strp):
-                        continue
-                    elif not compare_time(entry.published_parsed, t_start=s_time, strp=strp):
-                        total_results = 0
-                        break
+                published = entry.published_parsed
+                if e_time and published > e_time:
+                    continue
+                elif s_time and published < s_time:
+                    if newest_first:
+                        return
+                    continue
                 try:
                     yield Result._from_feed_entry(entry)
                 except Result.MissingFieldError:
                     logger.warning("Skipping partial result")
                     continue
 
+OAI_URL = "https://export.arxiv.org/oai2"
+_OAI = "{http://www.openarchives.org/OAI/2.0/}"
+_ARXIV = "{http://arxiv.org/OAI/arXiv/}"
+
+class ArxivOAIClient(object):
+    """
+    Bulk metadata harvesting through OAI-PMH `ListRecords`, following the
+    `resumptionToken` until the list is exhausted.
+
+    OAI-PMH has no search: records are selected by set (e.g. "cs") and date.
+    Yields the same `Result` objects as `ArxivClient.results`.
+    """
+    def __init__(self, session=None, limiter=None):
+        self._session = session if session is not None else build_session()
+        self._limiter = limiter
+
+    def _records(self, params):
+        while params:
+            token = None
+            # flow control (503 + Retry-After) is handled by fetch.
+            # Read the whole page and close the response before yielding: the
+            # consumer may be slow (rate-limited pdf downloads) and the server
+            # drops connections that are not read in time.
+            with fetch(self._session, OAI_URL, self._limiter, params=params) as r:
+                page = r.content
+            tags = (_OAI + "record", _OAI + "resumptionToken", _OAI + "error")
+            for _, elem in etree.iterparse(io.BytesIO(page), tag=tags):
+                if elem.tag == _OAI + "record":
+                    yield elem
+                elif elem.tag == _OAI + "resumptionToken":
+                    token = (elem.text or "").strip()
+                    logger.info("Harvested {} of {} records".format(
+                        elem.get("cursor"), elem.get("completeListSize")))
+                elif elem.get("code") != "noRecordsMatch":
+                    logger.warning("OAI-PMH error {}: {}".format(elem.get("code"), elem.text))
+                # drop what has been consumed
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            params = {"verb": "ListRecords", "resumptionToken": token} if token else None
+
+    @staticmethod
+    def _to_result(record):
+        header = record.find(_OAI + "header")
+        if header is not None and header.get("status") == "deleted":
+            return None
+        meta = record.find(_OAI + "metadata/" + _ARXIV + "arXiv")
+        if meta is None:
+            return None
+
+        def text(tag):
+            return " ".join((meta.findtext(_ARXIV + tag) or "").split())
+
+        paper_id = text("id")
+        published = datetime.strptime(text("created"), "%Y-%m-%d")
+        updated = datetime.strptime(text("updated"), "%Y-%m-%d") if text("updated") else published
+        authors = []
+        for author in meta.iterfind(_ARXIV + "authors/" + _ARXIV + "author"):
+            name = [author.findtext(_ARXIV + k) for k in ("forenames", "keyname", "suffix")]
+            authors.append(Result.Author(" ".join(n for n in name if n)))
+        categories = text("categories").split()
+        return Result(entry_id="http://arxiv.org/abs/" + paper_id,
+                      updated=updated,
+                      published=published,
+                      title=text("title"),
+                      authors=authors,
+                      summary=text("abstract"),
+                      comment=text("comments"),
+                      journal_ref=text("journal-ref"),
+                      doi=text("doi"),
+                      primary_category=categories[0] if categories else "",
+                      categories=categories,
+                      links=[Result.Link("http://arxiv.org/pdf/" + paper_id, title="pdf",
+                                         content_type="application/pdf")])
+
+    def results(self, set_spec="cs", s_time=None, e_time=None) -> Generator[Result, None, None]:
+        params = {"verb": "ListRecords", "metadataPrefix": "arXiv", "set": set_spec}
+        # `from` filters on the last-modified datestamp, which is never before
+        # the submission date; the exact range is checked on `created` below
+        if s_time:
+            params["from"] = time.strftime("%Y-%m-%d", s_time)
+        for record in self._records(params):
+            result = self._to_result(record)
+            if result is None:
+                continue
+            published = result.published.timetuple()
+            if (e_time and published > e_time) or (s_time and published < s_time):
+                continue
+            yield result
+
 class ArxivTool(object):
-    def __init__(self, config):
+    def __init__(self, config, backend=None):
         self._config(config)
+        if backend is not None:
+            self.cfg["backend"] = backend
+        assert self.cfg["backend"] in ["api", "oai"], self.cfg["backend"]
+        self._session = build_session(pool_maxsize=self.cfg["download_workers"],
+                                      contact=self.cfg["contact_email"])
+        self._limiter = RateLimiter(self.cfg["download_interval"], self._session,
+                                    robots_url="https://arxiv.org/robots.txt")
 
     def _config(self, config_file):
         self.cfg = {}
-        # 将 YAML 字符串写入文件
-        with open(config_file, 'r', encoding='utf-8') as f:
-            info = yaml.load(f.read(), Loader=yaml.FullLoader)
+        info = load_yaml(config_file)
 
         # Search config
         self.cfg["query"] = info.get('query', None)
@@ -113,6 +272,9 @@ class ArxivTool(object):
         self.cfg["s_time"] = info.get('s_time', None)
         self.cfg["e_time"] = info.get('e_time', None)
         self.cfg["offset"] = info.get('offset', 0)
+        # "api": arXiv query API, "oai": OAI-PMH bulk harvest of `oai_set` (query is ignored)
+        self.cfg["backend"] = info.get('backend', 'api')
+        self.cfg["oai_set"] = info.get('oai_set', 'cs')
 
         # save config
         # pdf config
@@ -121,6 +283,10 @@ class ArxivTool(object):
         self.cfg["save_pdf"] = info.get('save_pdf', False)
         self.cfg["with_source"] = info.get('with_source', False)
         self.cfg["pdf_dir"] = os.path.join(self.cfg["save_root"], "pdf")
+        self.cfg["download_workers"] = info.get('download_workers', 4)
+        # seconds between two requests to arxiv.org, robots.txt Crawl-delay wins if longer
+        self.cfg["download_interval"] = info.get('download_interval', 3)
+        self.cfg["contact_email"] = info.get('contact_email', None)
         # xlsx config
         self.cfg["save_xlsx"] = info.get('save_xlsx', False)
         self.cfg['xlsx_sorted'] = info.get('xlsx_sorted', None)
@@ -133,25 +299,11 @@ class ArxivTool(object):
         self.cfg["markdown_path"] = os.path.join(self.cfg["save_root"], self.cfg["markdown_name"])
 
         # info config
-        default_list = ['paper_id',             #   paper_id # 文章id
-                        'paper_title',          #   paper_title # 文章标题
-                        'paper_first_author',   #   paper_first_author # 文章的第一作者
-                        'paper_all_author',     #   paper_all_author  # 文章的所有作者
-                        'publish_time',         #   publish_time # 文章的发布时间
-                        'update_time',          #   update_time # 文章的更新时间
-                        'paper_summary',        #   paper_summary # 文章摘要
-                        'paper_url',            #   paper_url # 文章url
-                        'pdf_url',              #   pdf_url # 文章url
-                        'comment',              #   comment # 解释
-                        'doi',
-                        'primary_category',     # 文章主方向
-                        'categories']           # 文章涉及方向
-
-        self.cfg["xlsx_list"] = info.get('xlsx_list', default_list)
-        self.cfg["markdown_list"] = info.get('markdown_list', default_list)
+        self.cfg["xlsx_list"] = info.get('xlsx_list', list(_DEFAULT_LIST))
+        self.cfg["markdown_list"] = info.get('markdown_list', list(_DEFAULT_LIST))
         # check information in all list
-        for info_i in self.cfg["xlsx_list"] + self.cfg["markdown_list"]:
-            assert info_i in default_list , info_i
+        for info_i in itertools.chain(self.cfg["xlsx_list"], self.cfg["markdown_list"]):
+            assert info_i in _DEFAULT_FIELDS , info_i
 
     def serch(self, **kwargs):
         sort_by = kwargs.get('sort_by', SortCriterion.SubmittedDate)
@@ -165,64 +317,81 @@ class ArxivTool(object):
         return arxiv_search
 
     def results(self, **kwargs):
+        if self.cfg["backend"] == "oai":
+            client = ArxivOAIClient(self._session, RateLimiter(self.cfg["download_interval"], self._session))
+            res = client.results(self.cfg["oai_set"],
+                                 s_time = strp_time(self.cfg["s_time"]),
+                                 e_time = strp_time(self.cfg["e_time"]))
+            if self.cfg["max_results"] != float('inf'):
+                res = itertools.islice(res, self.cfg["max_results"])
+            return res
+
         arxiv_search = self.serch(**kwargs)
         return arxiv_search.results(offset = self.cfg["offset"], s_time = self.cfg["s_time"], e_time = self.cfg["e_time"], strp = True)
 
-    def format_res(self, **kwargs):
-        info_format = []
+    def format_res_iter(self, **kwargs):
+        # a paper can show up twice if it is updated while the search is paged
+        seen = set()
         for result_i in self.results(**kwargs):
+            paper_id = result_i.get_short_id()
+            base_id = _VERSION_RE.sub("", paper_id)
+            if base_id in seen:
+                continue
+            seen.add(base_id)
             info_i = dict(
-                paper_id=result_i.get_short_id(),  # 文章id
+                paper_id=paper_id,  # 文章id
                 paper_title = result_i.title,  # 文章标题
                 comment = result_i.comment,
                 paper_url = result_i.entry_id,  # 文章url
-                pdf_url = result_i.pdf_url,  # pdf url
+                pdf_url = canonical_url(result_i.pdf_url),  # pdf url
                 paper_summary = result_i.summary.replace("\n", ""),  # 文章摘要需要剔除格式
-                paper_first_author = "{}".format(result_i.authors[0]),  # 文章的第一作者
-                paper_all_author = ", ".join(["{}".format(name) for name in result_i.authors]),  # 文章的第一作者
-                publish_time = "{}".format(result_i.published.date()),  # 文章的发布时间
-                update_time = "{}".format(result_i.updated.date()),  # 文章的更新时间
-                doi = "{}".format(result_i) if result_i.doi else "",
+                paper_first_author = str(result_i.authors[0]),  # 文章的第一作者
+                paper_all_author = ", ".join(map(str, result_i.authors)),  # 文章的第一作者
+                publish_time = result_i.published.date().isoformat(),  # 文章的发布时间
+                update_time = result_i.updated.date().isoformat(),  # 文章的更新时间
+                doi = result_i.doi or "",
                 primary_category = result_i.primary_category, # 文章主方向
                 categories = ", ".join(result_i.categories)                # 文章所属方向
             )
-            info_format.append(info_i)
-
-        return info_format
-
-    def check_info(self, info, info_list):
-        info_check = []
-        for info_i in info:
-            tmp = collections.OrderedDict()
-            for k in info_list:
-                tmp[k] = info_i[k]
-            info_check.append(tmp)
-        return info_check
-
-    def dict2pd(self, info, info_list, sorted=None):
-        data = collections.OrderedDict()
-        for k in info_list:
-            data[k] = [info_i[k] for info_i in info]
-        # convert to dataframe using from_dict method
-        pd_data = pd.DataFrame.from_dict(data)
-        if sorted and sorted in pd_data:
-            pd_data = pd_data.sort_values(by=sorted).reset_index()
-        return pd_data
+            yield info_i
+
+    def format_res(self, **kwargs):
+        return list(self.format_res_iter(**kwargs))
+
+    def sort_info(self, info, info_list, sort_key=None):
+        if sort_key in info_list:
+            return sorted(info, key=lambda info_i: info_i[sort_key] or "")
+        return info
 
     def save_xlsx(self, info, info_list):
-        pd_data = self.dict2pd(info, info_list, sorted=self.cfg["xlsx_sorted"])
+        info = self.sort_info(info, info_list, self.cfg["xlsx_sorted"])
         os.makedirs(os.path.dirname(self.cfg["xlsx_path"]), exist_ok=True)
-        pd_data.to_excel(self.cfg["xlsx_path"], index=True)
+        # constant_memory flushes each row as soon as the next one starts
+        workbook = xlsxwriter.Workbook(self.cfg["xlsx_path"], {"constant_memory": True,
+                                                               "strings_to_formulas": False,
+                                                               "strings_to_urls": False})
+        worksheet = workbook.add_worksheet()
+        header = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+        for j, k in enumerate(info_list):
+            worksheet.write_string(0, j + 1, k, header)
+        for i, info_i in enumerate(info):
+            worksheet.write_number(i + 1, 0, i, header)
+            for j, k in enumerate(info_list):
+                worksheet.write(i + 1, j + 1, info_i[k])
+        workbook.close()
 
         print("xlsx: {}".format(self.cfg["xlsx_path"]))
 
     def save_markdown(self, info, info_list):
-        pd_data = self.dict2pd(info, info_list, sorted=self.cfg["markdown_sorted"])
+        info = self.sort_info(info, info_list, self.cfg["markdown_sorted"])
 
-        md_data = pd_data.to_markdown()
+        # rows are written one by one, same layout as DataFrame.to_markdown()
         os.makedirs(os.path.dirname(self.cfg["markdown_path"]), exist_ok=True)
         with open(self.cfg["markdown_path"], "w", encoding="utf-8") as file:
-            file.write(md_data)
+            file.write("|    | " + " | ".join(info_list) + " |\n")
+            file.write("|---:|" + "|".join(":---" for _ in info_list) + "|\n")
+            for i, info_i in enumerate(info):
+                file.write("| {} | ".format(i) + " | ".join(md_cell(info_i[k]) for k in info_list) + " |\n")
 
         print("Markdown: {}".format(self.cfg["markdown_path"]))
 
@@ -233,32 +402,59 @@ class ArxivTool(object):
         nonempty_title = res['paper_title'] if res['paper_title'] else "UNTITLED"
         return '.'.join([
             res['paper_id'].replace("/", "_"),
-            re.sub(r"[^\w]", "_", nonempty_title),
+            nonempty_title.translate(_SANITIZE_TABLE) if nonempty_title.isascii()
+            else _SANITIZE_RE.sub("_", nonempty_title),
             extension
         ])
 
-    def save_pdf(self, info):
-        os.makedirs(self.cfg["pdf_dir"], exist_ok=True)
-        for info_i in tqdm(info):
-            filename = self._get_default_filename(info_i)
-            pdf_path = os.path.join(self.cfg["pdf_dir"], filename)
-            written_path, _ = urlretrieve(info_i["pdf_url"], pdf_path)
+    def _download_one(self, info_i):
+        filename = self._get_default_filename(info_i)
+        pdf_path = os.path.join(self.cfg["pdf_dir"], filename)
+        try:
+            download(self._session, info_i["pdf_url"], pdf_path, self._limiter, self._manifest)
 
             # Bodge: construct the source URL from the PDF URL.
             if self.cfg["with_source"]:
                 source_filename = self._get_default_filename(info_i, "tar.gz")
                 source_path = os.path.join(self.cfg["pdf_dir"], source_filename)
                 source_url = info_i["pdf_url"].replace('/pdf/', '/src/')
-                written_path, _ = urlretrieve(source_url, source_path)
-        print("PDF done. {}".format(self.cfg["pdf_dir"]))
+                download(self._session, source_url, source_path, self._limiter, self._manifest)
+        except Exception as e:
+            logger.warning("Failed to download {}: {}".format(info_i["pdf_url"], e))
+            return False
+        return True
+
+    def save_pdf(self, info):
+        os.makedirs(self.cfg["pdf_dir"], exist_ok=True)
+        # the old urlretrieve loop could leave truncated pdfs, verify unlisted files
+        self._manifest = Manifest(self.cfg["pdf_dir"], trust_unlisted=False)
+        failed = 0
+        # downloads are network bound, overlap them with a small thread pool
+        jobs = run_bounded(self._download_one, info, self.cfg["download_workers"])
+        try:
+            for _, ok in tqdm(jobs, total=len(info) if isinstance(info, list) else None):
+                if not ok:
+                    failed += 1
+        finally:
+            self._manifest.save()
+        print("PDF done. {} (failed: {})".format(self.cfg["pdf_dir"], failed))
 
     def __call__(self, *args, **kwargs):
+        save_xlsx = self.cfg['save_xlsx'] and len(self.cfg['xlsx_list'])
+        save_markdown = self.cfg['save_markdown'] and len(self.cfg['markdown_list'])
+
+        if not (save_xlsx or save_markdown):
+            # pdf only: download while arXiv is still being paged
+            if self.cfg['save_pdf']:
+                self.save_pdf(self.format_res_iter())
+            return
+
         info = self.format_res()
 
-        if self.cfg['save_xlsx'] and len(self.cfg['xlsx_list']):
+        if save_xlsx:
             self.save_xlsx(info, self.cfg['xlsx_list'])
 
-        if self.cfg['save_markdown'] and len(self.cfg['markdown_list']):
+        if save_markdown:
             self.save_markdown(info, self.cfg['markdown_list'])
 
         if self.cfg['save_pdf']:
@@ -270,5 +466,6 @@ if __name__ == '__main__':
     # r".\configs\iccv_2023.yml"
     parser = argparse.ArgumentParser()
     parser.add_argument('cfg')
+    parser.add_argument('--backend', choices=['api', 'oai'], default=None)
     args = parser.parse_args()
-    a = ArxivTool(args.cfg)()
\ No newline at end of file
+    a = ArxivTool(args.cfg, backend=args.backend)()
\ No newline at end of file
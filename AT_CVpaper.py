@@ -1,54 +1,76 @@
 import argparse
-import re
-import requests
-import urllib.request
 import os
-import socket
+import logging
+import lxml.html
 from tqdm import tqdm
+from AT_download import TIMEOUT, Manifest, RateLimiter, build_session, download, run_bounded
 
-socket.setdefaulttimeout(30)
+logger = logging.getLogger(__name__)
+
+_SANITIZE_TABLE = str.maketrans(":\"?/ ", "_____")
 
 class CVP(object):
-    def __init__(self, url, dst, dtype="CVPR"):
+    def __init__(self, url, dst, dtype="CVPR", interval=1, workers=8):
         self.url = url
         self.dst = dst
         assert dtype in ["CVPR", "ECCV", "ICCV", "WACV", "ACCV"]
+        self.workers = workers
+        self._session = build_session(pool_maxsize=workers)
+        self._limiter = RateLimiter(interval, self._session,
+                                    robots_url="https://openaccess.thecvf.com/robots.txt")
         self.info_dict = self.get_url_info()
         self.num = len(self.info_dict)
 
     def get_url_info(self):
-        r = requests.get(self.url)
-        data = r.text
-        link_list = re.findall(r"(?<=href=\").+?pdf(?=\">pdf)", data)
-        name_list = re.findall(r"(?<=paper.html\">).+(?=</a>)", data)
-        if len(link_list) != len(name_list):
-            name_list = [os.path.basename(url) for url in link_list]
+        r = self._session.get(self.url, timeout=TIMEOUT)
+        tree = lxml.html.fromstring(r.content)
         info_dict = {}
-        for i, file_name in enumerate(name_list):
-            info_dict[link_list[i]] = re.sub("[:\"?/ ]", "_", file_name)
+        title = None
+        # paper titles and their "pdf" links, in document order
+        for a in tree.xpath("//dt[@class='ptitle']/a | //a[normalize-space()='pdf']"):
+            if a.getparent().tag == "dt":
+                title = a.text_content().strip()
+                continue
+            link = a.get("href")
+            if not link:
+                continue
+            file_name = title or os.path.splitext(os.path.basename(link))[0]
+            info_dict[link] = file_name.translate(_SANITIZE_TABLE)
+            title = None
         return info_dict
 
+    def _download_one(self, job):
+        url, save_path = job
+        try:
+            download(self._session, url, save_path, self._limiter, self._manifest)
+        except Exception as e:
+            logger.warning("Failed to download {}: {}".format(url, e))
+            return False
+        return True
+
     def download_pdf(self):
         os.makedirs(self.dst, exist_ok=True)
 
-        with tqdm(total=self.num) as pbar:
-            for url, file_name in self.info_dict.items():
-                save_path = os.path.join(self.dst, file_name + '.pdf')
-                if os.path.exists(save_path):
-                    pbar.set_description("File exists")  # 进度条前加内容
-                    pbar.set_postfix(file_name='{}'.format(file_name + '.pdf'))
-                    pbar.update()
-                    continue
-                else:
-                    # download pdf file
-                    pbar.set_description("Downloading")  # 进度条前加内容
-                    pbar.set_postfix(file_name='{}'.format(file_name + '.pdf'))
+        self._manifest = Manifest(self.dst)
+        todo = []
+        for url, file_name in self.info_dict.items():
+            url = 'http://openaccess.thecvf.com/' + url
+            save_path = os.path.join(self.dst, file_name + '.pdf')
+            if not self._manifest.has(url, save_path):
+                todo.append((url, save_path))
+
+        failed = 0
+        with tqdm(total=self.num, initial=self.num - len(todo)) as pbar:
+            pbar.set_description("Downloading")  # 进度条前加内容
+            try:
+                for (_, save_path), ok in run_bounded(self._download_one, todo, self.workers):
+                    if not ok:
+                        failed += 1
+                    pbar.set_postfix(file_name=os.path.basename(save_path))
                     pbar.update()
-                    try:
-                        urllib.request.urlretrieve('http://openaccess.thecvf.com/' + url, filename=save_path)
-                    except:
-                        continue
-        print("Finished!")
+            finally:
+                self._manifest.save()
+        print("Finished! (failed: {})".format(failed))
 
 
 if __name__ == '__main__':
@@ -56,6 +78,9 @@ if __name__ == '__main__':
     # 'https://openaccess.thecvf.com/CVPR2023?day=all'
     parser.add_argument('url')
     parser.add_argument('dst')
+    # seconds between two downloads
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--workers', type=int, default=8)
     args = parser.parse_args()
 
-    CVP(args.url, args.dst).download_pdf()
\ No newline at end of file
+    CVP(args.url, args.dst, interval=args.interval, workers=args.workers).download_pdf()
\ No newline at end of file
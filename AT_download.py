@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.robotparser import RobotFileParser
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "daily_paper/0.1 (+https://github.com/AlchemyAITech/daily_paper)"
+CHUNK_SIZE = 1 << 16  # 64 KiB
+TIMEOUT = 30
+# statuses servers use to tell a crawler to slow down, see `fetch`
+BACKOFF_STATUS = {403, 429, 503}
+
+
+class TCPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose pooled sockets set TCP_NODELAY and SO_KEEPALIVE.
+    """
+    socket_options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                      (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_session(pool_maxsize=8, contact=None):
+    """
+    A requests.Session shared by all downloads of one tool, so keep-alive
+    connections (and their TLS handshakes) are reused across files.
+    `contact` is an optional email sent as the `From` header.
+    """
+    # 429/503 are left to `fetch`, which backs off much longer than urllib3 would
+    # and goes through the rate limiter on every retry. urllib3 would otherwise
+    # still retry them by itself whenever the response carries Retry-After.
+    retry = Retry(total=5,
+                  backoff_factor=1.0,
+                  status_forcelist=[500, 502, 504],
+                  allowed_methods=["HEAD", "GET"],
+                  respect_retry_after_header=False)
+    adapter = TCPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    if contact:
+        session.headers.update({"From": contact})
+    return session
+
+
+class RateLimiter(object):
+    """
+    Spaces requests at least `interval` seconds apart, shared by all threads.
+
+    When `robots_url` is given, its `Crawl-delay` is re-read every
+    `robots_ttl` seconds and used instead of `interval` if it is longer.
+    """
+    def __init__(self, interval, session=None, robots_url=None, robots_ttl=3600):
+        self.interval = interval
+        self._session = session if session is not None else requests.Session()
+        self._robots_url = robots_url
+        self._robots_ttl = robots_ttl
+        self._robots_checked = None
+        self._crawl_delay = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _robots_due(self):
+        # claims the refresh under the lock, so only one thread fetches robots.txt
+        if self._robots_url is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if self._robots_checked is not None and now - self._robots_checked < self._robots_ttl:
+                return False
+            self._robots_checked = now
+            return True
+
+    def _refresh_robots(self):
+        try:
+            r = self._session.get(self._robots_url, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            logger.warning("Failed to read {}: {}".format(self._robots_url, e))
+            return
+        if r.status_code >= 400:
+            crawl_delay = 0
+        else:
+            parser = RobotFileParser()
+            parser.parse(r.text.splitlines())
+            crawl_delay = float(parser.crawl_delay(USER_AGENT) or 0)
+        with self._lock:
+            self._crawl_delay = crawl_delay
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next - now)
+            self._next = now + delay + max(self.interval, self._crawl_delay)
+        if delay:
+            time.sleep(delay)
+
+    def wait(self):
+        # robots.txt is fetched outside the lock, in a slot of its own
+        if self._robots_due():
+            self._reserve()
+            self._refresh_robots()
+        self._reserve()
+
+
+def _retry_after(r):
+    try:
+        return float(r.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch(session, url, limiter=None, retries=5, method="GET", **kwargs):
+    """
+    `session.request` behind `limiter`, backing off exponentially (or as told
+    by Retry-After) while the server answers with one of BACKOFF_STATUS.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        r = session.request(method, url, **kwargs)
+        if r.status_code not in BACKOFF_STATUS or attempt == retries:
+            try:
+                r.raise_for_status()
+            except requests.HTTPError:
+                # give a streamed connection back to the pool
+                r.close()
+                raise
+            return r
+        r.close()
+        delay = _retry_after(r) or min(60, 2 ** attempt) + random.uniform(0, 1)
+        logger.warning("HTTP {} for {}, retrying in {:.1f}s".format(r.status_code, url, delay))
+        time.sleep(delay)
+
+
+class Manifest(object):
+    """
+    `_manifest.json` of a download directory: url -> {"len"} of every
+    completed download, so later runs only fetch what is missing or truncated.
+
+    Files on disk without an entry (downloaded before the manifest existed)
+    are trusted as complete when `trust_unlisted` is set. Otherwise
+    `download` checks their size against a HEAD request first.
+    """
+    def __init__(self, dirname, trust_unlisted=True):
+        self.path = os.path.join(dirname, "_manifest.json")
+        self.trust_unlisted = trust_unlisted
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def has(self, url, path):
+        if not os.path.exists(path):
+            return False
+        entry = self._data.get(url)
+        if entry is None:
+            return self.trust_unlisted
+        return entry["len"] == os.path.getsize(path)
+
+    def unlisted(self, url, path):
+        return url not in self._data and os.path.exists(path)
+
+    def add(self, url, path):
+        with self._lock:
+            self._data[url] = {"len": os.path.getsize(path)}
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+def download(session, url, path, limiter=None, manifest=None):
+    """
+    Stream `url` into `path + ".part"` and rename it to `path` once complete,
+    so an interrupted run never leaves a truncated file under the real name.
+    A leftover `.part` is resumed with a Range request, or just renamed when
+    it already has the full Content-Length.
+
+    With a `manifest`, complete files are skipped without any request and
+    finished downloads are recorded in it. An existing file it does not list
+    is kept only when its size matches the Content-Length of a HEAD request
+    (unless the manifest trusts unlisted files), and is fetched again otherwise.
+    """
+    # ask for the bytes as stored, so sizes and ranges match the file on disk
+    headers = {"Accept-Encoding": "identity"}
+    if manifest is not None:
+        if manifest.has(url, path):
+            return path
+        if manifest.unlisted(url, path):
+            # possibly truncated by an older run: keep it only if the size matches
+            head = fetch(session, url, limiter, method="HEAD", headers=headers, allow_redirects=True)
+            if int(head.headers.get("Content-Length", -1)) == os.path.getsize(path):
+                manifest.add(url, path)
+                return path
+    part_path = path + ".part"
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if done:
+        head = fetch(session, url, limiter, method="HEAD", headers=headers, allow_redirects=True)
+        length = int(head.headers.get("Content-Length", -1))
+        if length == done:
+            os.replace(part_path, path)
+            if manifest is not None:
+                manifest.add(url, path)
+            return path
+        if done < length and head.headers.get("Accept-Ranges") == "bytes":
+            headers["Range"] = "bytes={}-".format(done)
+
+    with fetch(session, url, limiter, stream=True, headers=headers) as r:
+        # 206: the server honoured Range, anything else restarts from scratch
+        mode = "ab" if r.status_code == 206 else "wb"
+        with open(part_path, mode) as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+    os.replace(part_path, path)
+    if manifest is not None:
+        manifest.add(url, path)
+    return path
+
+
+def run_bounded(fn, items, workers):
+    """
+    Run `fn(item)` on `workers` threads for every item of the (possibly lazy)
+    iterable `items`, yielding `(item, result)` pairs as they complete.
+
+    Items are pulled only while fewer than 2 * workers are in flight, so a
+    generator feeding it starts downloading before it is exhausted.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(fn, item)] = item
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()